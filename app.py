@@ -1,18 +1,24 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 import csv
 import io
 import os
 import bcrypt
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError
 from dotenv import load_dotenv
 from database import (
     init_db,
-    add_participant,
+    close_db,
+    db_transaction,
+    add_participants_bulk,
     get_all_participants,
+    get_opposite_gender_participants,
     get_participant_by_token,
-    add_selection,
+    add_selections_bulk,
     get_selections_by_participant,
-    clear_selections,
     clear_all_data,
     get_all_matches
 )
@@ -21,29 +27,76 @@ from matching import run_matching_algorithm
 # Load environment variables
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        # Flask asks for indent=2 when pretty-printing debug responses
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
-# Get password hash from environment variable
+# Close the per-request database connection when the app context ends
+app.teardown_appcontext(close_db)
+
+# Get password hash from environment variable (argon2id, or bcrypt for older deploys)
 ADMIN_PASSWORD_HASH = os.getenv('ADMIN_PASSWORD_HASH', '').encode('utf-8')
+password_hasher = PasswordHasher()
+if not ADMIN_PASSWORD_HASH:
+    app.logger.warning('ADMIN_PASSWORD_HASH is not set; admin login is disabled')
+
+# Get frontend URL from environment variable, fallback to localhost for development
+FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:5173')
+
+# Valid CSV rows are inserted in transactions of this many participants
+CSV_BATCH_SIZE = 1000
 
 # Initialize database on startup
 init_db()
 
+def verify_admin_password(password):
+    """Check a password against the admin hash, argon2id or legacy bcrypt"""
+    if ADMIN_PASSWORD_HASH.startswith(b'$argon2'):
+        try:
+            return password_hasher.verify(ADMIN_PASSWORD_HASH, password)
+        except VerificationError:
+            return False
+    return bcrypt.checkpw(password.encode('utf-8'), ADMIN_PASSWORD_HASH)
+
 @app.route('/api/admin/login', methods=['POST'])
 def admin_login():
-    """Admin login endpoint with bcrypt password verification"""
-    data = request.json
+    """Admin login endpoint with argon2id/bcrypt password verification"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Invalid JSON body'}), 400
     password = data.get('password', '')
     
+    # Skip the expensive hash check when it cannot succeed
+    if not ADMIN_PASSWORD_HASH or not password:
+        return jsonify({'success': False, 'message': 'Invalid password'}), 401
+    
     try:
-        if bcrypt.checkpw(password.encode('utf-8'), ADMIN_PASSWORD_HASH):
+        if verify_admin_password(password):
             return jsonify({'success': True, 'message': 'Login successful'})
         else:
             return jsonify({'success': False, 'message': 'Invalid password'}), 401
     except Exception as e:
         return jsonify({'success': False, 'message': 'Authentication error'}), 401
 
+def add_participant_batch(conn, rows, errors):
+    """Insert a batch of parsed CSV rows, recording duplicates in errors"""
+    duplicate_ids = add_participants_bulk(rows, conn)
+    errors.extend(f"Duplicate ID: {participant_id}" for participant_id in duplicate_ids)
+    return len(rows) - len(duplicate_ids)
+
 @app.route('/api/admin/upload-csv', methods=['POST'])
 def upload_csv():
     """Upload CSV file with participants"""
@@ -59,32 +112,38 @@ def upload_csv():
         return jsonify({'error': 'File must be a CSV'}), 400
     
     try:
-        # Read CSV file
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
+        # Stream the CSV file rather than reading it into memory
+        stream = io.TextIOWrapper(file.stream, encoding='utf-8', newline='')
         csv_reader = csv.DictReader(stream)
         
         participants_added = 0
+        batch = []
         errors = []
         
-        for row in csv_reader:
-            participant_id = int(row.get('id', 0))
-            first_name = row.get('first_name', '').strip()
-            gender = row.get('gender', '').strip().lower()
-            email = row.get('email', '').strip()
-            
-            if not participant_id or not first_name or not gender or not email:
-                errors.append(f"Invalid row: {row}")
-                continue
-            
-            if gender not in ['male', 'female']:
-                errors.append(f"Invalid gender for ID {participant_id}: {gender}")
-                continue
+        # One transaction for the whole file, so a bad row imports nothing;
+        # rows are still sent in bounded batches
+        with db_transaction() as conn:
+            for row in csv_reader:
+                participant_id = int(row.get('id', 0))
+                first_name = row.get('first_name', '').strip()
+                gender = row.get('gender', '').strip().lower()
+                email = row.get('email', '').strip()
+                
+                if not participant_id or not first_name or not gender or not email:
+                    errors.append(f"Invalid row: {row}")
+                    continue
+                
+                if gender not in ['male', 'female']:
+                    errors.append(f"Invalid gender for ID {participant_id}: {gender}")
+                    continue
+                
+                batch.append((participant_id, first_name, gender, email))
+                if len(batch) >= CSV_BATCH_SIZE:
+                    participants_added += add_participant_batch(conn, batch, errors)
+                    batch = []
             
-            token = add_participant(participant_id, first_name, gender, email)
-            if token:
-                participants_added += 1
-            else:
-                errors.append(f"Duplicate ID: {participant_id}")
+            if batch:
+                participants_added += add_participant_batch(conn, batch, errors)
         
         return jsonify({
             'success': True,
@@ -97,15 +156,15 @@ def upload_csv():
 
 @app.route('/api/admin/participants', methods=['GET'])
 def get_participants():
-    """Get all participants with their unique links"""
-    participants = get_all_participants()
-    
-    # Get frontend URL from environment variable, fallback to localhost for development
-    frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:5173')
+    """Get all participants with their unique links (optional ?limit=&offset=)"""
+    participants = get_all_participants(
+        limit=request.args.get('limit', type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
     
     # Add full link to each participant
     for p in participants:
-        p['link'] = f"{frontend_url}/participant/{p['unique_token']}"
+        p['link'] = f"{FRONTEND_URL}/participant/{p['unique_token']}"
     
     return jsonify(participants)
 
@@ -123,8 +182,11 @@ def run_matching():
 
 @app.route('/api/admin/matches', methods=['GET'])
 def get_matches():
-    """Get all matches"""
-    matches = get_all_matches()
+    """Get all matches (optional ?limit=&offset=)"""
+    matches = get_all_matches(
+        limit=request.args.get('limit', type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
     return jsonify(matches)
 
 @app.route('/api/admin/clear-all', methods=['POST'])
@@ -144,16 +206,10 @@ def get_participant(token):
     if not participant:
         return jsonify({'error': 'Invalid token'}), 404
     
-    # Get all participants for selection (excluding self and same gender)
-    all_participants = get_all_participants()
+    # Get participants available for selection (excluding self and same gender)
     participant_gender = participant['gender']
     opposite_gender = 'female' if participant_gender == 'male' else 'male'
-    
-    available_participants = [
-        {'id': p['id'], 'first_name': p['first_name']}
-        for p in all_participants
-        if p['id'] != participant['id'] and p['gender'] == opposite_gender
-    ]
+    available_participants = get_opposite_gender_participants(participant['id'], opposite_gender)
     
     # Get current selections with ranks
     current_selections = get_selections_by_participant(participant['id'])
@@ -172,18 +228,14 @@ def submit_selections(token):
     if not participant:
         return jsonify({'error': 'Invalid token'}), 404
     
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid JSON body'}), 400
     selections = data.get('selections', [])  # Array of {id, rank}
     
     try:
-        # Clear previous selections
-        clear_selections(participant['id'])
-        
-        # Add new selections with ranks
-        for selection in selections:
-            selected_id = selection.get('id')
-            rank = selection.get('rank', 0)
-            add_selection(participant['id'], selected_id, rank)
+        # Replace previous selections with the new ranked ones
+        add_selections_bulk(participant['id'], selections)
         
         return jsonify({
             'success': True,
@@ -1,201 +1,352 @@
+import base64
+import os
 import sqlite3
 import secrets
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from flask import g, has_app_context
 
 DB_PATH = Path(__file__).parent / 'matrimonial.db'
 
+# Random bytes per participant token
+TOKEN_BYTES = 16
+
+# Pairs who selected each other, lower id first, with each side's rank
+MUTUAL_MATCHES_QUERY = '''
+    SELECT a.selector_id, a.selected_id, a.rank, b.rank
+    FROM selections a
+    JOIN selections b ON a.selector_id = b.selected_id AND a.selected_id = b.selector_id
+    WHERE a.selector_id < a.selected_id
+    ORDER BY a.selector_id, a.rank
+'''
+
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Get database connection, shared for the lifetime of the Flask app context"""
+    if has_app_context():
+        if 'db' not in g:
+            g.db = connect_db()
+        return g.db
+    return connect_db()
+
+def connect_db():
+    """Open a new tuned database connection"""
+    # Autocommit mode: multi-statement writes open their own BEGIN; a larger
+    # statement cache keeps every helper's SQL prepared across calls
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, isolation_level=None)
+    # Per-connection tuning; with WAL, NORMAL only syncs at checkpoints
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-65536')
     return conn
 
+def release_db(conn):
+    """Close a connection unless it belongs to the current app context"""
+    if not (has_app_context() and g.get('db') is conn):
+        conn.close()
+
+@contextmanager
+def db_connection():
+    """
+    Connection for a with block; released on exit even if a query raises
+    Writers nest `with conn:` to commit on success or roll back on error
+    """
+    conn = get_db()
+    try:
+        yield conn
+    finally:
+        release_db(conn)
+
+@contextmanager
+def db_transaction():
+    """Connection with an open transaction, committed on exit or rolled back on error"""
+    with db_connection() as conn, conn:
+        conn.execute('BEGIN')
+        yield conn
+
+def close_db(e=None):
+    """Close the app context's shared connection, if one was opened"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 def init_db():
     """Initialize database with required tables"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Participants table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS participants (
-            id INTEGER PRIMARY KEY,
-            first_name TEXT NOT NULL,
-            gender TEXT NOT NULL,
-            email TEXT NOT NULL,
-            unique_token TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        
+        # Participants table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS participants (
+                id INTEGER PRIMARY KEY,
+                first_name TEXT NOT NULL,
+                gender TEXT NOT NULL,
+                email TEXT NOT NULL,
+                unique_token TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Selections table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS selections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                selector_id INTEGER NOT NULL,
+                selected_id INTEGER NOT NULL,
+                rank INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(selector_id, selected_id),
+                FOREIGN KEY (selector_id) REFERENCES participants(id),
+                FOREIGN KEY (selected_id) REFERENCES participants(id)
+            )
+        ''')
+        
+        # Matches table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS matches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                participant1_id INTEGER NOT NULL,
+                participant2_id INTEGER NOT NULL,
+                rank1 INTEGER DEFAULT 0,
+                rank2 INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (participant1_id) REFERENCES participants(id),
+                FOREIGN KEY (participant2_id) REFERENCES participants(id)
+            )
+        ''')
+        
+        # Admin credentials table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin (
+                id INTEGER PRIMARY KEY,
+                password_hash TEXT NOT NULL
+            )
+        ''')
+        
+        # Participant pages list everyone of the opposite gender
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_participants_gender ON participants(gender)')
+        
+        # Current lookups (including both sides of the mutual-match join) use the
+        # UNIQUE(selector_id, selected_id) index; this one is kept for future
+        # reverse lookups by selected_id
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_selections_selected ON selections(selected_id)')
+        
+        # Write-ahead logging is persistent, so it only needs setting once
+        cursor.execute('PRAGMA journal_mode=WAL')
     
-    # Selections table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS selections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            selector_id INTEGER NOT NULL,
-            selected_id INTEGER NOT NULL,
-            rank INTEGER NOT NULL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(selector_id, selected_id),
-            FOREIGN KEY (selector_id) REFERENCES participants(id),
-            FOREIGN KEY (selected_id) REFERENCES participants(id)
-        )
-    ''')
-    
-    # Matches table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS matches (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            participant1_id INTEGER NOT NULL,
-            participant2_id INTEGER NOT NULL,
-            rank1 INTEGER DEFAULT 0,
-            rank2 INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (participant1_id) REFERENCES participants(id),
-            FOREIGN KEY (participant2_id) REFERENCES participants(id)
-        )
-    ''')
-    
-    # Admin credentials table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admin (
-            id INTEGER PRIMARY KEY,
-            password_hash TEXT NOT NULL
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
     print("Database initialized successfully!")
 
 def generate_unique_token():
     """Generate a unique token for participant links"""
-    return secrets.token_urlsafe(16)
+    return secrets.token_urlsafe(TOKEN_BYTES)
+
+def generate_unique_tokens(count):
+    """Generate count participant tokens from a single OS random draw"""
+    # Same format as generate_unique_token: unpadded URL-safe base64
+    buf = os.urandom(TOKEN_BYTES * count)
+    return [
+        base64.urlsafe_b64encode(buf[i:i + TOKEN_BYTES]).rstrip(b'=').decode('ascii')
+        for i in range(0, len(buf), TOKEN_BYTES)
+    ]
 
 def add_participant(participant_id, first_name, gender, email):
     """Add a participant to the database"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    token = generate_unique_token()
-    
-    try:
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        
+        token = generate_unique_token()
+        
         cursor.execute(
-            'INSERT INTO participants (id, first_name, gender, email, unique_token) VALUES (?, ?, ?, ?, ?)',
+            'INSERT OR IGNORE INTO participants (id, first_name, gender, email, unique_token) VALUES (?, ?, ?, ?, ?)',
             (participant_id, first_name, gender, email, token)
         )
-        conn.commit()
-        conn.close()
-        return token
-    except sqlite3.IntegrityError:
-        conn.close()
-        return None
+        # rowcount is 0 when the row conflicted with an existing one
+        added = cursor.rowcount == 1
+    return token if added else None
 
-def get_all_participants():
-    """Get all participants"""
-    conn = get_db()
+def add_participants_bulk(rows, conn=None):
+    """
+    Add (id, first_name, gender, email) rows in a single transaction
+    Pass conn from db_transaction() to add them to that larger transaction instead
+    Returns the ids that were skipped as duplicates
+    """
+    if conn is None:
+        with db_transaction() as conn:
+            return add_participants_bulk(rows, conn)
+    
     cursor = conn.cursor()
-    cursor.execute('SELECT id, first_name, gender, email, unique_token FROM participants ORDER BY id')
-    participants = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    
+    tokens = generate_unique_tokens(len(rows))
+    rows_with_tokens = [(*row, token) for row, token in zip(rows, tokens)]
+    
+    cursor.executemany(
+        'INSERT OR IGNORE INTO participants (id, first_name, gender, email, unique_token) VALUES (?, ?, ?, ?, ?)',
+        rows_with_tokens
+    )
+    
+    # Only when some rows were ignored, find which: their id holds another token
+    duplicate_ids = []
+    if cursor.rowcount < len(rows_with_tokens):
+        for row in rows_with_tokens:
+            cursor.execute('SELECT unique_token FROM participants WHERE id = ?', (row[0],))
+            stored = cursor.fetchone()
+            if stored is None or stored[0] != row[4]:
+                duplicate_ids.append(row[0])
+    
+    return duplicate_ids
+
+def paginate(query, limit=None, offset=0):
+    """Append LIMIT/OFFSET to a query; returns the query and its parameters"""
+    if limit is None and not offset:
+        return query, ()
+    # A negative LIMIT means no limit in SQLite
+    return query + ' LIMIT ? OFFSET ?', (-1 if limit is None else limit, offset)
+
+def get_all_participants(limit=None, offset=0):
+    """Get all participants, optionally one page of them"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(*paginate(
+            'SELECT id, first_name, gender, email, unique_token FROM participants ORDER BY id',
+            limit, offset
+        ))
+        participants = [dict(row) for row in cursor.fetchall()]
+    return participants
+
+def get_opposite_gender_participants(participant_id, gender):
+    """Get id and first name of participants of the given gender, excluding one participant"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(
+            'SELECT id, first_name FROM participants WHERE gender = ? AND id <> ? ORDER BY id',
+            (gender, participant_id)
+        )
+        participants = [dict(row) for row in cursor.fetchall()]
     return participants
 
 def get_participant_by_token(token):
     """Get participant by their unique token"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, first_name, gender FROM participants WHERE unique_token = ?', (token,))
-    participant = cursor.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute('SELECT id, first_name, gender FROM participants WHERE unique_token = ?', (token,))
+        participant = cursor.fetchone()
     return dict(participant) if participant else None
 
 def add_selection(selector_id, selected_id, rank=0):
     """Add a selection (who selected whom) with ranking"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        
         cursor.execute(
-            'INSERT INTO selections (selector_id, selected_id, rank) VALUES (?, ?, ?)',
+            'INSERT OR IGNORE INTO selections (selector_id, selected_id, rank) VALUES (?, ?, ?)',
             (selector_id, selected_id, rank)
         )
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
+        # rowcount is 0 when the selection already existed
+        added = cursor.rowcount == 1
+    return added
+
+def add_selections_bulk(selector_id, selections):
+    """Replace a participant's selections in a single transaction"""
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+
+        conn.execute('BEGIN')
+        cursor.execute('DELETE FROM selections WHERE selector_id = ?', (selector_id,))
+        cursor.executemany(
+            'INSERT OR IGNORE INTO selections (selector_id, selected_id, rank) VALUES (?, ?, ?)',
+            [(selector_id, s.get('id'), s.get('rank', 0)) for s in selections]
+        )
 
 def get_selections_by_participant(participant_id):
     """Get all selections made by a participant with ranks"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT selected_id, rank FROM selections WHERE selector_id = ? ORDER BY rank', (participant_id,))
-    selections = [{'selected_id': row[0], 'rank': row[1]} for row in cursor.fetchall()]
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT selected_id, rank FROM selections WHERE selector_id = ? ORDER BY rank', (participant_id,))
+        selections = [{'selected_id': row[0], 'rank': row[1]} for row in cursor.fetchall()]
     return selections
 
 def clear_selections(participant_id):
     """Clear all selections for a participant"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM selections WHERE selector_id = ?', (participant_id,))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM selections WHERE selector_id = ?', (participant_id,))
 
 def clear_all_data():
     """Clear all participants, selections, and matches"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM matches')
-    cursor.execute('DELETE FROM selections')
-    cursor.execute('DELETE FROM participants')
-    conn.commit()
-    conn.close()
-
-def get_all_matches():
-    """Get all matches with participant names and ranks"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            m.id,
-            m.participant1_id,
-            p1.first_name as name1,
-            m.participant2_id,
-            p2.first_name as name2,
-            m.rank1,
-            m.rank2
-        FROM matches m
-        JOIN participants p1 ON m.participant1_id = p1.id
-        JOIN participants p2 ON m.participant2_id = p2.id
-        ORDER BY m.id
-    ''')
-    
-    matches = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        conn.execute('BEGIN')
+        cursor.execute('DELETE FROM matches')
+        cursor.execute('DELETE FROM selections')
+        cursor.execute('DELETE FROM participants')
+
+def get_all_matches(limit=None, offset=0):
+    """Get all matches with participant names and ranks, optionally one page of them"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        
+        cursor.execute(*paginate('''
+            SELECT 
+                m.id,
+                m.participant1_id,
+                p1.first_name as name1,
+                m.participant2_id,
+                p2.first_name as name2,
+                m.rank1,
+                m.rank2
+            FROM matches m
+            JOIN participants p1 ON m.participant1_id = p1.id
+            JOIN participants p2 ON m.participant2_id = p2.id
+            ORDER BY m.id
+        ''', limit, offset))
+        
+        matches = [dict(row) for row in cursor.fetchall()]
     return matches
 
 def clear_matches():
     """Clear all matches"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM matches')
-    conn.commit()
-    conn.close()
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM matches')
 
 def add_match(participant1_id, participant2_id, rank1=0, rank2=0):
     """Add a match to the database with mutual ranks"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'INSERT INTO matches (participant1_id, participant2_id, rank1, rank2) VALUES (?, ?, ?, ?)',
-        (participant1_id, participant2_id, rank1, rank2)
-    )
-    conn.commit()
-    conn.close()
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            'INSERT INTO matches (participant1_id, participant2_id, rank1, rank2) VALUES (?, ?, ?, ?)',
+            (participant1_id, participant2_id, rank1, rank2)
+        )
+
+def get_mutual_matches():
+    """Get all mutual selections as match dicts with ranks"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(MUTUAL_MATCHES_QUERY)
+        matches = [
+            {'participant1_id': row[0], 'participant2_id': row[1], 'rank1': row[2], 'rank2': row[3]}
+            for row in cursor.fetchall()
+        ]
+    return matches
+
+def store_mutual_matches():
+    """Replace all matches with the current mutual selections in a single transaction"""
+    with db_connection() as conn, conn:
+        cursor = conn.cursor()
+
+        conn.execute('BEGIN IMMEDIATE')
+        cursor.execute('DELETE FROM matches')
+        cursor.execute(
+            'INSERT INTO matches (participant1_id, participant2_id, rank1, rank2) ' + MUTUAL_MATCHES_QUERY
+        )
+        num_matches = cursor.rowcount
+    return num_matches
 
 if __name__ == '__main__':
     init_db()